@@ -1,16 +1,53 @@
 import panel as pn
 import pandas as pd
 import pickle
+import joblib
 import sqlite3
 import hashlib
+import functools
+import hmac
+import os
+import atexit
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.naive_bayes import GaussianNB
 import io
 import numpy as np
+import numexpr as ne
+import jax
+import jax.numpy as jnp
+
+jax.config.update("jax_enable_x64", True)
 
 pn.extension()
 
 # Database Setup
-conn = sqlite3.connect("fraud_detection.db", check_same_thread=False)
+# Callbacks run on worker threads, so each thread lazily opens its own connection
+_db_local = threading.local()
+
+def get_conn():
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect("fraud_detection.db", check_same_thread=False, cached_statements=256)
+        # WAL with NORMAL sync skips the fsync per commit: the database stays consistent
+        # after a crash, but the most recent commits may be lost on power failure
+        conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        """)
+        _db_local.conn = conn
+    return conn
+
+def close_thread_conn():
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None:
+        _db_local.conn = None
+        conn.close()
+
+conn = get_conn()
 cursor = conn.cursor()
 
 # Drop tables if they exist (only do this during development)
@@ -58,108 +95,198 @@ CREATE TABLE IF NOT EXISTS predictions (
     FOREIGN KEY(user_id) REFERENCES users(id)
 )""")
 
-conn.commit()
+# Indexes for the profile lookup in predict_fraud and per-user history queries
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS idx_customer_lookup
+ON customer_data(user_id, customer_id, name, date DESC)""")
+
+cursor.execute("""
+CREATE INDEX IF NOT EXISTS idx_pred_user
+ON predictions(user_id, timestamp DESC)""")
+
+# The UNIQUE constraint on users.username already provides this index
+cursor.execute("DROP INDEX IF EXISTS idx_users_name")
 
+conn.commit()
 
-# Load model and encoders
-try:
-    with open("naive_bayes.pkl", "rb") as f:
-        model = pickle.load(f)
+# Hot-path statements kept as constants so sqlite3's statement cache reuses the prepared form
+PROFILE_SQL = """
+SELECT age, previous_claims
+FROM customer_data
+WHERE user_id=? AND customer_id=? AND name=?
+ORDER BY date DESC LIMIT 1
+"""
+
+INSERT_PRED_SQL = """
+INSERT INTO predictions (
+    user_id, customer_id, name, claim_amount, age, diagnosis,
+    hospital_type, previous_claims, prediction, probability
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Uploaded columns stored in customer_data, in table order
+CUSTOMER_COLUMNS = ['user_id', 'customer_id', 'date', 'age', 'name', 'diagnosis',
+                    'hospital_type', 'previous_claims', 'claim_amount']
+
+# Rows per multi-row INSERT, kept under SQLite's 999 bound-parameter limit
+UPLOAD_CHUNK_SIZE = 999 // len(CUSTOMER_COLUMNS)
+
+INSERT_CUSTOMER_SQL = f"INSERT INTO customer_data ({', '.join(CUSTOMER_COLUMNS)}) VALUES "
+CUSTOMER_ROW_PLACEHOLDER = f"({', '.join('?' * len(CUSTOMER_COLUMNS))})"
+
+# Numeric column types for uploaded files, applied once the headers are normalized
+UPLOAD_DTYPES = {'age': 'int32', 'previous_claims': 'int32', 'claim_amount': 'float64'}
+
+
+# Business rules applied on top of the model probability
+HIGH_AMOUNT = 300000
+HIGH_AMOUNT_ADJ = 0.10
+FREQUENT_CLAIMS = 5
+FREQUENT_CLAIMS_ADJ = 0.15
+SUSPICIOUS_DIAGNOSES = frozenset({'cancer', 'heart disease'})
+SUSPICIOUS_DIAGNOSIS_ADJ = 0.20
+PRIVATE_HOSPITAL_ADJ = 0.10
+FRAUD_THRESHOLD = 0.35
+
+
+# Model artifacts written by naive_bayes_model.py
+MODEL_FILES = ("naive_bayes.joblib", "naive_bayes.pkl", "label_encoders.pkl")
+
+# GaussianNB inference as a compiled tensor op over the fitted parameters
+def _build_nb_predict_proba(model):
+    theta = jnp.asarray(model.theta_)
+    var = jnp.asarray(model.var_)
+    log_prior = jnp.log(jnp.asarray(model.class_prior_))
+
+    @jax.jit
+    def nb_predict_proba(X):
+        joint_ll = -0.5 * jnp.sum(
+            jnp.log(2 * jnp.pi * var) + (X[:, None, :] - theta) ** 2 / var,
+            axis=-1) + log_prior
+        return jax.nn.softmax(joint_ll, axis=-1)
+
+    # Warm up so the first single-row prediction doesn't pay for compilation
+    nb_predict_proba(jnp.zeros((1, theta.shape[1])))
+    return nb_predict_proba
+
+def _load_model_artifacts():
+    try:
+        model = joblib.load("naive_bayes.joblib", mmap_mode='r')
+    except FileNotFoundError:
+        # Fall back to models saved before the switch to joblib
+        with open("naive_bayes.pkl", "rb") as f:
+            model = pickle.load(f)
     with open("label_encoders.pkl", "rb") as f:
         label_encoders = pickle.load(f)
-except FileNotFoundError as e:
-    print(f"Error loading model files: {e}")
-    exit(1)
+
+    # Label -> code lookups, built once instead of calling LabelEncoder.transform per prediction
+    diag_map = {c: i for i, c in enumerate(label_encoders["Diagnosis"].classes_)}
+    hosp_map = {c: i for i, c in enumerate(label_encoders["HospitalType"].classes_)}
+    return diag_map, hosp_map, _build_nb_predict_proba(model)
+
+# Load model and encoders.
+# panel serve re-runs this script per session, so the model, its encoder maps and the
+# compiled predictor are cached together and only rebuilt when the artifact files change
+model_mtimes = tuple(os.path.getmtime(f) if os.path.exists(f) else None for f in MODEL_FILES)
+cached = pn.state.cache.get('model_artifacts')
+if cached is None or cached[0] != model_mtimes:
+    try:
+        pn.state.cache['model_artifacts'] = (model_mtimes, _load_model_artifacts())
+    except FileNotFoundError as e:
+        print(f"Error loading model files: {e}")
+        exit(1)
+diag_map, hosp_map, _nb_predict_proba = pn.state.cache['model_artifacts'][1]
+
+def predict_proba(X):
+    # Pad rows to a power-of-two bucket so jit compiles once per bucket, not once per row count
+    n = X.shape[0]
+    bucket = 1 << max(n - 1, 0).bit_length()
+    padded = np.zeros((bucket, X.shape[1]), dtype=np.float64)
+    padded[:n] = X
+    return np.asarray(_nb_predict_proba(jnp.asarray(padded)))[:n]
 
 # Helper functions
+# Logged-in user, set once by login_user so later actions skip re-authenticating
+current_session = {'user_id': None}
+
+def _scrypt(password, salt):
+    return hashlib.scrypt(password.encode(), salt=salt, n=2**14, r=8, p=1)
+
 def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+    salt = os.urandom(16)
+    return f"{salt.hex()}${_scrypt(password, salt).hex()}"
+
+def verify_password(password, stored):
+    if '$' not in stored:
+        # Accounts created before scrypt hashing store a bare SHA-256 digest
+        return hmac.compare_digest(stored, hashlib.sha256(password.encode()).hexdigest())
+    salt, digest = stored.split('$', 1)
+    return hmac.compare_digest(digest, _scrypt(password, bytes.fromhex(salt)).hex())
 
 def authenticate(username, password):
+    cursor = get_conn().cursor()
     cursor.execute("SELECT id, password FROM users WHERE username=?", (username,))
     user = cursor.fetchone()
-    return (user[0], user[1] == hash_password(password)) if user else (None, False)
+    return (user[0], verify_password(password, user[1])) if user else (None, False)
 
 def preprocess_input(claim_amount, age, diagnosis, hospital_type, previous_claims):
-    try:
-        diagnosis_encoded = label_encoders["Diagnosis"].transform([diagnosis])[0] 
-    except:
-        diagnosis_encoded = 0
+    diagnosis_encoded = diag_map.get(diagnosis, 0)
+    hospital_type_encoded = hosp_map.get(hospital_type, 0)
         
-    try:
-        hospital_type_encoded = label_encoders["HospitalType"].transform([hospital_type])[0]
-    except:
-        hospital_type_encoded = 0
-        
-    return pd.DataFrame([[claim_amount, age, diagnosis_encoded, hospital_type_encoded, previous_claims]],
-                       columns=["ClaimAmount", "Age", "Diagnosis", "HospitalType", "PreviousClaims"])
+    # Feature order: ClaimAmount, Age, Diagnosis, HospitalType, PreviousClaims
+    return np.array([[claim_amount, age, diagnosis_encoded, hospital_type_encoded, previous_claims]],
+                    dtype=np.float64)
 
 def predict_fraud(user_id, customer_id, name, diagnosis, hospital_type, claim_amount):
+    conn = get_conn()
+    cursor = conn.cursor()
     # Get customer's basic profile (age and previous claims)
-    cursor.execute("""
-        SELECT age, previous_claims 
-        FROM customer_data 
-        WHERE user_id=? AND customer_id=? AND name=?
-        ORDER BY date DESC LIMIT 1
-    """, (user_id, customer_id, name))
+    cursor.execute(PROFILE_SQL, (user_id, customer_id, name))
     
     profile = cursor.fetchone()
     if not profile:
         return "Error: Customer profile not found", 0.0
 
     age, previous_claims = profile
+    amount = float(claim_amount)
+    age = int(age)
+    previous_claims = int(previous_claims)
     
     # Preprocess data for model
     input_data = preprocess_input(
-        claim_amount=float(claim_amount),
-        age=int(age),
+        claim_amount=amount,
+        age=age,
         diagnosis=diagnosis,
         hospital_type=hospital_type,
-        previous_claims=int(previous_claims))
+        previous_claims=previous_claims)
     
     # Get base prediction
     try:
-        prediction_prob = model.predict_proba(input_data.to_numpy())[0][1]
+        prediction_prob = predict_proba(input_data)[0][1]
     except:
         prediction_prob = 0.0
     
     # Apply business rules
-    rules = {
-        'high_amount': {'threshold': 300000, 'adjustment': 0.10},
-        'frequent_claims': {'threshold': 5, 'adjustment': 0.15},
-        'suspicious_diagnosis': {'list': ['cancer', 'heart disease'], 'adjustment': 0.20},
-        'private_hospital': {'adjustment': 0.10}
-    }
-    
-    # High amount rule
-    if float(claim_amount) > rules['high_amount']['threshold']:
-        prediction_prob += rules['high_amount']['adjustment']
+    if amount > HIGH_AMOUNT:
+        prediction_prob += HIGH_AMOUNT_ADJ
     
-    # Frequent claims rule
-    if int(previous_claims) > rules['frequent_claims']['threshold']:
-        prediction_prob += rules['frequent_claims']['adjustment']
+    if previous_claims > FREQUENT_CLAIMS:
+        prediction_prob += FREQUENT_CLAIMS_ADJ
     
-    # Suspicious diagnosis rule
-    if diagnosis.lower() in rules['suspicious_diagnosis']['list']:
-        prediction_prob += rules['suspicious_diagnosis']['adjustment']
+    if diagnosis.lower() in SUSPICIOUS_DIAGNOSES:
+        prediction_prob += SUSPICIOUS_DIAGNOSIS_ADJ
     
-    # Private hospital rule
     if hospital_type.lower() == 'private':
-        prediction_prob += rules['private_hospital']['adjustment']
+        prediction_prob += PRIVATE_HOSPITAL_ADJ
     
     # Cap probability between 0-1
     prediction_prob = max(0, min(1, prediction_prob))
     
     # Determine result
-    result = "Fraud" if prediction_prob > 0.35 else "Legitimate"
+    result = "Fraud" if prediction_prob > FRAUD_THRESHOLD else "Legitimate"
     
     # Store prediction
-    cursor.execute("""
-    INSERT INTO predictions (
-        user_id, customer_id, name, claim_amount, age, diagnosis,
-        hospital_type, previous_claims, prediction, probability
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+    cursor.execute(INSERT_PRED_SQL, (
         user_id, customer_id, name, claim_amount, age, diagnosis,
         hospital_type, previous_claims, result, prediction_prob
     ))
@@ -167,6 +294,68 @@ def predict_fraud(user_id, customer_id, name, diagnosis, hospital_type, claim_am
     
     return result, prediction_prob
 
+# All rule adjustments as one expression, evaluated by numexpr in a single threaded pass
+RULES_EXPR = (
+    "probs"
+    " + where(claim > high_amount, high_adj, 0.0)"
+    " + where(prev > freq_claims, freq_adj, 0.0)"
+    " + where(diag_is_susp, susp_adj, 0.0)"
+    " + where(is_private, private_adj, 0.0)"
+)
+
+def insert_customer_rows(cursor, rows):
+    # One multi-row INSERT per chunk on the caller's cursor, so it joins the caller's transaction
+    for start in range(0, len(rows), UPLOAD_CHUNK_SIZE):
+        chunk = rows[start:start + UPLOAD_CHUNK_SIZE]
+        cursor.execute(INSERT_CUSTOMER_SQL + ", ".join([CUSTOMER_ROW_PLACEHOLDER] * len(chunk)),
+                       [value for row in chunk for value in row])
+
+def encode_column(mapping, values):
+    # Unknown labels fall back to 0, same as preprocess_input
+    return values.map(mapping).fillna(0).to_numpy(dtype=np.float64)
+
+def predict_fraud_batch(user_id, df):
+    # Score every row of a cleaned customer DataFrame (see process_excel) in one model call
+    cursor = get_conn().cursor()
+    diagnoses = df['diagnosis']
+    hospital_types = df['hospital_type']
+    claim = df['claim_amount'].to_numpy(dtype=np.float64)
+    age = df['age'].to_numpy(dtype=np.float64)
+    prev = df['previous_claims'].to_numpy(dtype=np.float64)
+
+    X = np.column_stack([
+        claim,
+        age,
+        encode_column(diag_map, diagnoses),
+        encode_column(hosp_map, hospital_types),
+        prev
+    ])
+    probs = predict_proba(X)[:, 1]
+
+    # Apply business rules
+    diag_is_susp = np.isin(diagnoses.str.lower().to_numpy(), list(SUSPICIOUS_DIAGNOSES))
+    is_private = (hospital_types.str.lower() == 'private').to_numpy()
+    probs = ne.evaluate(RULES_EXPR, local_dict={
+        'probs': probs, 'claim': claim, 'prev': prev,
+        'diag_is_susp': diag_is_susp, 'is_private': is_private,
+        'high_amount': HIGH_AMOUNT, 'high_adj': HIGH_AMOUNT_ADJ,
+        'freq_claims': FREQUENT_CLAIMS, 'freq_adj': FREQUENT_CLAIMS_ADJ,
+        'susp_adj': SUSPICIOUS_DIAGNOSIS_ADJ, 'private_adj': PRIVATE_HOSPITAL_ADJ
+    })
+    np.clip(probs, 0, 1, out=probs)
+
+    results = np.where(probs > FRAUD_THRESHOLD, "Fraud", "Legitimate")
+
+    # Store predictions; the caller's transaction commits them
+    rows = list(zip(
+        [user_id] * len(df), df['customer_id'], df['name'], claim.tolist(),
+        df['age'].tolist(), diagnoses, hospital_types,
+        df['previous_claims'].tolist(), results.tolist(), probs.tolist()
+    ))
+    cursor.executemany(INSERT_PRED_SQL, rows)
+
+    return results, probs
+
 # UI Components
 login_username = pn.widgets.TextInput(name="Username", placeholder="Enter username")
 login_password = pn.widgets.PasswordInput(name="Password", placeholder="Enter password")
@@ -199,61 +388,97 @@ login_link = pn.widgets.Button(name="Don't have an account? Sign up", button_typ
 signup_link = pn.widgets.Button(name="Already have an account? Login", button_type="light")
 
 # Functions
-def process_excel(event):
+# Click handlers that hit SQLite or the model run here instead of on the event loop.
+# panel serve re-runs this script per session, so the pool is shared through pn.state.cache
+if 'executor' not in pn.state.cache:
+    pn.state.cache['executor'] = ThreadPoolExecutor(max_workers=4)
+    atexit.register(pn.state.cache['executor'].shutdown)
+executor = pn.state.cache['executor']
+
+logger = logging.getLogger(__name__)
+
+def _log_failure(future):
+    exc = future.exception()
+    if exc is not None:
+        logger.error("Background callback failed", exc_info=exc)
+
+def _run_job(func, event, doc):
+    # Each job closes its own worker connection, so session cleanup never touches one in use
+    try:
+        func(event, doc)
+    finally:
+        close_thread_conn()
+
+def in_background(func):
+    @functools.wraps(func)
+    def handler(event):
+        future = executor.submit(_run_job, func, event, pn.state.curdoc)
+        future.add_done_callback(_log_failure)
+    return handler
+
+def show(doc, pane, message, color):
+    # Widgets must be updated from the document's own thread
+    def update():
+        pane.object = message
+        pane.style = {'color': color}
+    if doc is None:
+        update()
+    else:
+        doc.add_next_tick_callback(update)
+
+@in_background
+def process_excel(event, doc):
     if not file_input.value:
-        upload_output.object = "### Please select a file first"
-        upload_output.style = {'color': 'red'}
+        show(doc, upload_output, "### Please select a file first", 'red')
         return
 
     try:
-        user_id, _ = authenticate(login_username.value, login_password.value)
+        user_id = current_session['user_id']
         if not user_id:
-            upload_output.object = "### Error: Authentication failed"
-            upload_output.style = {'color': 'red'}
+            show(doc, upload_output, "### Error: Authentication failed", 'red')
             return
 
-        df = pd.read_excel(io.BytesIO(file_input.value))
+        data = io.BytesIO(file_input.value)
+        if (file_input.filename or '').lower().endswith('.csv'):
+            df = pd.read_csv(data)
+        else:
+            df = pd.read_excel(data, engine='calamine')
         df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
         
         required_cols = {'customer_id', 'date', 'age', 'name', 'diagnosis', 'hospital_type', 'previous_claims', 'claim_amount'}
         if not required_cols.issubset(set(df.columns)):
             missing = required_cols - set(df.columns)
-            upload_output.object = f"### Error: Missing columns: {', '.join(missing)}"
-            upload_output.style = {'color': 'red'}
+            show(doc, upload_output, f"### Error: Missing columns: {', '.join(missing)}", 'red')
             return
 
-        for _, row in df.iterrows():
-            cursor.execute("""
-            INSERT INTO customer_data (
-                user_id, customer_id, date, age, name, diagnosis, 
-                hospital_type, previous_claims, claim_amount
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                user_id, 
-                str(row['customer_id']).strip(),
-                str(row['date']),
-                int(row['age']),
-                str(row['name']).strip(),
-                str(row['diagnosis']).strip(),
-                str(row['hospital_type']).strip(),
-                int(row['previous_claims']),
-                float(row['claim_amount'])
-            ))
-        
-        conn.commit()
-        upload_output.object = "### Data uploaded successfully! ✅"
-        upload_output.style = {'color': 'green'}
+        # Clean whole columns at once rather than casting row by row
+        for col in ('customer_id', 'name', 'diagnosis', 'hospital_type'):
+            df[col] = df[col].astype(str).str.strip()
+        df['date'] = df['date'].map(str)
+        df = df.astype(UPLOAD_DTYPES)
+
+        df['user_id'] = user_id
+
+        rows = list(zip(*(df[col].tolist() for col in CUSTOMER_COLUMNS)))
+
+        conn = get_conn()
+        # Customer rows and their predictions share one transaction, committed on exit
+        with conn:
+            insert_customer_rows(conn.cursor(), rows)
+            results, _ = predict_fraud_batch(user_id, df)
+        flagged = int((results == "Fraud").sum())
+
+        show(doc, upload_output, f"### Data uploaded successfully! ✅ ({flagged} of {len(df)} claims flagged as fraud)", 'green')
         
     except Exception as e:
-        upload_output.object = f"### Error: {str(e)}"
-        upload_output.style = {'color': 'red'}
+        show(doc, upload_output, f"### Error: {str(e)}", 'red')
 
-def on_submit(event):
+@in_background
+def on_submit(event, doc):
     try:
-        user_id, authenticated = authenticate(login_username.value, login_password.value)
-        if not authenticated:
-            output.object = "### Error: Please login first"
-            output.style = {'color': 'red'}
+        user_id = current_session['user_id']
+        if not user_id:
+            show(doc, output, "### Error: Please login first", 'red')
             return
 
         # Validate all required fields
@@ -267,15 +492,13 @@ def on_submit(event):
         
         if not all(required_fields.values()):
             missing = [k for k, v in required_fields.items() if not v]
-            output.object = f"### Error: Missing fields: {', '.join(missing)}"
-            output.style = {'color': 'red'}
+            show(doc, output, f"### Error: Missing fields: {', '.join(missing)}", 'red')
             return
 
         try:
             claim_amt = float(claim_amount.value)
         except ValueError:
-            output.object = "### Error: Claim amount must be a number"
-            output.style = {'color': 'red'}
+            show(doc, output, "### Error: Claim amount must be a number", 'red')
             return
 
         result, probability = predict_fraud(
@@ -289,19 +512,16 @@ def on_submit(event):
 
         # Display results
         if "Error:" in result:
-            output.object = f"### {result}"
-            output.style = {'color': 'red'}
+            show(doc, output, f"### {result}", 'red')
         else:
-            output.object = f"""
+            show(doc, output, f"""
             ### Prediction Results:
             - **Status**: {result}
             - **Probability**: {probability:.1%}
-            """
-            output.style = {'color': 'green' if result == "Legitimate" else 'red'}
+            """, 'green' if result == "Legitimate" else 'red')
             
     except Exception as e:
-        output.object = f"### Error: {str(e)}"
-        output.style = {'color': 'red'}
+        show(doc, output, f"### Error: {str(e)}", 'red')
 
 def login_user(event):
     username = login_username.value.strip()
@@ -314,6 +534,7 @@ def login_user(event):
         
     user_id, authenticated = authenticate(username, password)
     if authenticated:
+        current_session['user_id'] = user_id
         login_message.object = "### Login successful! ✅"
         login_message.style = {'color': 'green'}
         main_area[:] = [dashboard]
@@ -336,8 +557,9 @@ def signup_user(event):
         return
         
     try:
-        cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", 
-                      (username, hash_password(password)))
+        conn = get_conn()
+        conn.execute("INSERT INTO users (username, password) VALUES (?, ?)",
+                     (username, hash_password(password)))
         conn.commit()
         signup_message.object = "### Signup successful! Please login. ✅"
         signup_message.style = {'color': 'green'}
@@ -401,11 +623,14 @@ app = pn.template.FastListTemplate(
     accent_base_color="#1f77b4"
 )
 
-def cleanup():
+def cleanup(session_context=None):
+    # Worker connections are closed by their jobs; only the session's own connection is left
     conn.close()
     print("Database connection closed")
 
-import atexit
-atexit.register(cleanup)
+if pn.state.curdoc and pn.state.curdoc.session_context:
+    pn.state.on_session_destroyed(cleanup)
+else:
+    atexit.register(cleanup)
 
 app.servable()
@@ -1,15 +1,33 @@
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
 import pickle
+import joblib
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 from sklearn.naive_bayes import GaussianNB
 from sklearn.metrics import accuracy_score
 
+# Function to label-encode a string column with Arrow's dictionary encoding
+def encode_labels(values):
+    encoded = pc.dictionary_encode(values).combine_chunks()
+    classes = encoded.dictionary.to_numpy(zero_copy_only=False)
+
+    # Arrow numbers labels by first appearance; renumber them in sorted order like LabelEncoder
+    order = np.argsort(classes)
+    rank = np.empty(len(classes), dtype=np.int64)
+    rank[order] = np.arange(len(classes))
+    indices = encoded.indices
+    codes = rank[pc.fill_null(indices, 0).to_numpy()]
+
+    le = LabelEncoder()
+    le.classes_ = classes[order]
+    # Missing labels stay null so the mean fill handles them like any other column
+    return pa.array(codes, mask=indices.is_null().to_numpy(zero_copy_only=False)), le
+
 # Function to load and preprocess data
 def preprocess_data(file_path):
-    # Load dataset
-    df = pd.read_csv(file_path)
-
     # Select relevant features
     selected_columns = [
         "ClaimAmount",
@@ -19,25 +37,31 @@ def preprocess_data(file_path):
         "PreviousClaims",
         "FraudFlag",
     ]
-    df = df[selected_columns]
 
-    # Handle categorical data using Label Encoding
+    # Load dataset
+    tbl = pv.read_csv(file_path).select(selected_columns)
+
     label_encoders = {}
     categorical_columns = ["Diagnosis", "HospitalType"]
-    for col in categorical_columns:
-        le = LabelEncoder()
-        df[col] = le.fit_transform(df[col])
-        label_encoders[col] = le
+    columns = []
+    for col in selected_columns:
+        values = tbl[col]
+
+        # Handle categorical data using Label Encoding
+        if col in categorical_columns:
+            values, label_encoders[col] = encode_labels(values)
 
-    # Handle missing values by filling with mean for numerical columns
-    df = df.fillna(df.mean())
+        # Handle missing values by filling with the column mean
+        values = pc.cast(values, pa.float64())
+        values = pc.fill_null(values, pc.mean(values))
+        columns.append(values.to_numpy())
 
-    return df, label_encoders
+    return np.column_stack(columns), label_encoders
 
 # Function to split data into train and test
-def split_data(df):
-    X = df.iloc[:, :-1].values  
-    y = df.iloc[:, -1].values  
+def split_data(arr):
+    X = arr[:, :-1]
+    y = arr[:, -1]
 
     # Split the data into train and test sets (80% train, 20% test)
     X_train, X_test, y_train, y_test = train_test_split(
@@ -51,9 +75,8 @@ def train_naive_bayes(X_train, y_train):
     model = GaussianNB()
     model.fit(X_train, y_train)
 
-    # Save the trained model to a pickle file
-    with open("naive_bayes.pkl", "wb") as f:
-        pickle.dump(model, f)
+    # Save the trained model uncompressed so Panel.py can memory-map its arrays
+    joblib.dump(model, "naive_bayes.joblib", compress=0)
 
     return model
 
@@ -77,10 +100,10 @@ def evaluate_model(model, X_train, X_test, y_train, y_test):
 # Function to preprocess data, split it, train, evaluate, and save the model
 def main():
     # Load and preprocess the data
-    df, label_encoders = preprocess_data("synthetic_medical_aid_claims.csv")
+    arr, label_encoders = preprocess_data("synthetic_medical_aid_claims.csv")
 
     # Split the data into training and testing sets
-    X_train, X_test, y_train, y_test = split_data(df)
+    X_train, X_test, y_train, y_test = split_data(arr)
 
     # Train the Naïve Bayes model
     model = train_naive_bayes(X_train, y_train)